@@ -1,12 +1,14 @@
 """Cache Management
 """
 
+import functools
 import hashlib
 import json
 import logging
 import os
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from pipenv.patched.pip._vendor.packaging.tags import Tag, interpreter_name, interpreter_version
 from pipenv.patched.pip._vendor.packaging.utils import canonicalize_name
@@ -22,11 +24,99 @@ logger = logging.getLogger(__name__)
 
 ORIGIN_JSON_NAME = "origin.json"
 
+# Directory listings modified more recently than this are not reused.
+_RACY_MTIME_WINDOW_NS = 3 * 1_000_000_000
+
+# The same project names are looked up over and over during a resolve.
+_canonicalize_name = functools.lru_cache(maxsize=1024)(canonicalize_name)
+
+# json.dumps() builds a new encoder for every call made with non-default
+# options; keys are produced once per link, so share a single one instead.
+_KEY_ENCODER = json.JSONEncoder(
+    sort_keys=True, separators=(",", ":"), ensure_ascii=True
+)
+
+# Copying an initialized hash object is cheaper than constructing a new one.
+_SHA224 = hashlib.sha224()
+
 
 def _hash_dict(d: Dict[str, str]) -> str:
     """Return a stable sha224 of a dictionary."""
-    s = json.dumps(d, sort_keys=True, separators=(",", ":"), ensure_ascii=True)
-    return hashlib.sha224(s.encode("ascii")).hexdigest()
+    s = _KEY_ENCODER.encode(d)
+    h = _SHA224.copy()
+    h.update(s.encode("ascii"))
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _interpreter_key_parts() -> Tuple[str, str]:
+    """Return the interpreter name and version that go into every cache key.
+
+    These can't change during the lifetime of the process, so there is no
+    need to query them again for each link.
+    """
+    return interpreter_name(), interpreter_version()
+
+
+def _link_cache_key(
+    link: Link,
+) -> Tuple[str, Optional[str], Optional[str], Optional[str]]:
+    """Return the attributes of a link that its cache path depends on."""
+    return (
+        link.url_without_fragment,
+        link.hash_name,
+        link.hash,
+        link.subdirectory_fragment,
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _hashed_cache_path_parts(
+    url: str,
+    hash_name: Optional[str],
+    hash_value: Optional[str],
+    subdirectory: Optional[str],
+) -> Tuple[str, str, str, str]:
+    """Get parts of path that must be os.path.joined with cache_dir
+
+    The same link is usually looked up several times during a single run
+    (persistent cache, ephemeral cache, wheel building), so the hashing is
+    memoized on the attributes returned by _link_cache_key.
+    """
+
+    # We want to generate an url to use as our cache key, we don't want to
+    # just re-use the URL because it might have other items in the fragment
+    # and we don't care about those.
+    key_parts = {"url": url}
+    if hash_name is not None and hash_value is not None:
+        key_parts[hash_name] = hash_value
+    if subdirectory:
+        key_parts["subdirectory"] = subdirectory
+
+    # Include interpreter name, major and minor version in cache key
+    # to cope with ill-behaved sdists that build a different wheel
+    # depending on the python version their setup.py is being run on,
+    # and don't encode the difference in compatibility tags.
+    # https://github.com/pypa/pip/issues/7296
+    (
+        key_parts["interpreter_name"],
+        key_parts["interpreter_version"],
+    ) = _interpreter_key_parts()
+
+    # Encode our key url with sha224, we'll use this because it has similar
+    # security properties to sha256, but with a shorter total output (and
+    # thus less secure). However the differences don't make a lot of
+    # difference for our use case here. hashlib's sha224 is provided by
+    # OpenSSL, which already uses the CPU's SHA extensions when present.
+    # Note that a truncated sha256 is *not* a substitute: sha224 starts
+    # from different initial values, so the digests (and thus every
+    # existing cache path) would change.
+    hashed = _hash_dict(key_parts)
+
+    # We want to nest the directories some to prevent having a ton of top
+    # level directories where we might run out of sub directories on some
+    # FS.
+    return hashed[:2], hashed[2:4], hashed[4:6], hashed[6:]
 
 
 class Cache:
@@ -39,50 +129,38 @@ class Cache:
         super().__init__()
         assert not cache_dir or os.path.isabs(cache_dir)
         self.cache_dir = cache_dir or None
+        self._listings: Dict[str, Tuple[int, List[Any]]] = {}
 
     def _get_cache_path_parts(self, link: Link) -> List[str]:
         """Get parts of part that must be os.path.joined with cache_dir"""
+        return list(_hashed_cache_path_parts(*_link_cache_key(link)))
 
-        # We want to generate an url to use as our cache key, we don't want to
-        # just re-use the URL because it might have other items in the fragment
-        # and we don't care about those.
-        key_parts = {"url": link.url_without_fragment}
-        if link.hash_name is not None and link.hash is not None:
-            key_parts[link.hash_name] = link.hash
-        if link.subdirectory_fragment:
-            key_parts["subdirectory"] = link.subdirectory_fragment
-
-        # Include interpreter name, major and minor version in cache key
-        # to cope with ill-behaved sdists that build a different wheel
-        # depending on the python version their setup.py is being run on,
-        # and don't encode the difference in compatibility tags.
-        # https://github.com/pypa/pip/issues/7296
-        key_parts["interpreter_name"] = interpreter_name()
-        key_parts["interpreter_version"] = interpreter_version()
-
-        # Encode our key url with sha224, we'll use this because it has similar
-        # security properties to sha256, but with a shorter total output (and
-        # thus less secure). However the differences don't make a lot of
-        # difference for our use case here.
-        hashed = _hash_dict(key_parts)
-
-        # We want to nest the directories some to prevent having a ton of top
-        # level directories where we might run out of sub directories on some
-        # FS.
-        parts = [hashed[:2], hashed[2:4], hashed[4:6], hashed[6:]]
-
-        return parts
-
-    def _get_candidates(self, link: Link, canonical_package_name: str) -> List[Any]:
-        can_not_cache = not self.cache_dir or not canonical_package_name or not link
+    def _get_candidates(self, link: Link, package_name: Optional[str]) -> List[Any]:
+        can_not_cache = not self.cache_dir or not package_name or not link
         if can_not_cache:
             return []
 
-        candidates = []
         path = self.get_path_for_link(link)
-        if os.path.isdir(path):
-            for candidate in os.listdir(path):
-                candidates.append((candidate, path))
+        try:
+            # A link is typically looked up more than once per run; only list
+            # its directory again if it has been modified since the last time.
+            mtime = os.stat(path).st_mtime_ns
+            cached = self._listings.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            with os.scandir(path) as entries:
+                candidates = [(entry.name, path) for entry in entries]
+        except (FileNotFoundError, NotADirectoryError):
+            # Nothing has been cached for this link (yet).
+            self._listings.pop(path, None)
+            return []
+        # Directory mtimes have a coarse resolution (up to 2 seconds on FAT),
+        # so a wheel added right after this scan may leave the mtime as is.
+        # Only keep listings of directories that haven't changed recently.
+        if time.time_ns() - mtime > _RACY_MTIME_WINDOW_NS:
+            self._listings[path] = (mtime, candidates)
+        else:
+            self._listings.pop(path, None)
         return candidates
 
     def get_path_for_link(self, link: Link) -> str:
@@ -106,6 +184,10 @@ class SimpleWheelCache(Cache):
 
     def __init__(self, cache_dir: str) -> None:
         super().__init__(cache_dir)
+        # Store wheels within the root cache_dir
+        self._wheels_dir = (
+            os.path.join(self.cache_dir, "wheels") if self.cache_dir else None
+        )
 
     def get_path_for_link(self, link: Link) -> str:
         """Return a directory to store cached wheels for link
@@ -123,9 +205,8 @@ class SimpleWheelCache(Cache):
         :param link: The link of the sdist for which this will cache wheels.
         """
         parts = self._get_cache_path_parts(link)
-        assert self.cache_dir
-        # Store wheels within the root cache_dir
-        return os.path.join(self.cache_dir, "wheels", *parts)
+        assert self._wheels_dir
+        return os.path.join(self._wheels_dir, *parts)
 
     def get(
         self,
@@ -133,18 +214,24 @@ class SimpleWheelCache(Cache):
         package_name: Optional[str],
         supported_tags: List[Tag],
     ) -> Link:
-        candidates = []
-
         if not package_name:
             return link
 
-        canonical_package_name = canonicalize_name(package_name)
-        for wheel_name, wheel_dir in self._get_candidates(link, canonical_package_name):
+        wheel_candidates = self._get_candidates(link, package_name)
+        if not wheel_candidates:
+            return link
+
+        canonical_package_name = _canonicalize_name(package_name)
+        # Since the index of the tag in supported_tags is used as a priority,
+        # map each tag to it once instead of scanning the list per wheel.
+        tag_to_priority = {tag: idx for idx, tag in enumerate(supported_tags)}
+        best: Optional[Tuple[int, str, str]] = None
+        for wheel_name, wheel_dir in wheel_candidates:
             try:
                 wheel = Wheel(wheel_name)
             except InvalidWheelFilename:
                 continue
-            if canonicalize_name(wheel.name) != canonical_package_name:
+            if _canonicalize_name(wheel.name) != canonical_package_name:
                 logger.debug(
                     "Ignoring cached wheel %s for %s as it "
                     "does not match the expected distribution name %s.",
@@ -153,21 +240,21 @@ class SimpleWheelCache(Cache):
                     package_name,
                 )
                 continue
-            if not wheel.supported(supported_tags):
+            try:
+                priority = wheel.find_most_preferred_tag(
+                    supported_tags, tag_to_priority
+                )
+            except ValueError:
                 # Built for a different python/arch/etc
                 continue
-            candidates.append(
-                (
-                    wheel.support_index_min(supported_tags),
-                    wheel_name,
-                    wheel_dir,
-                )
-            )
+            candidate = (priority, wheel_name, wheel_dir)
+            if best is None or candidate < best:
+                best = candidate
 
-        if not candidates:
+        if best is None:
             return link
 
-        _, wheel_name, wheel_dir = min(candidates)
+        _, wheel_name, wheel_dir = best
         return Link(path_to_url(os.path.join(wheel_dir, wheel_name)))
 
 
@@ -217,7 +304,15 @@ class WheelCache(Cache):
     def __init__(self, cache_dir: str) -> None:
         super().__init__(cache_dir)
         self._wheel_cache = SimpleWheelCache(cache_dir)
-        self._ephem_cache = EphemWheelCache()
+        self._ephem_wheel_cache: Optional[EphemWheelCache] = None
+
+    @property
+    def _ephem_cache(self) -> EphemWheelCache:
+        # The ephemeral cache creates a temporary directory, so only set it up
+        # once something actually needs to be stored in it.
+        if self._ephem_wheel_cache is None:
+            self._ephem_wheel_cache = EphemWheelCache()
+        return self._ephem_wheel_cache
 
     def get_path_for_link(self, link: Link) -> str:
         return self._wheel_cache.get_path_for_link(link)
@@ -254,7 +349,12 @@ class WheelCache(Cache):
         if retval is not link:
             return CacheEntry(retval, persistent=True)
 
-        retval = self._ephem_cache.get(
+        if self._ephem_wheel_cache is None:
+            # Nothing can have been cached in an ephemeral cache that was
+            # never created.
+            return None
+
+        retval = self._ephem_wheel_cache.get(
             link=link,
             package_name=package_name,
             supported_tags=supported_tags,
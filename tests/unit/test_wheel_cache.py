@@ -0,0 +1,113 @@
+import os
+import tempfile
+import time
+
+import pytest
+
+from pipenv.patched.pip._vendor.packaging.tags import Tag
+
+from pipenv.patched.pip._internal.cache import SimpleWheelCache, WheelCache
+from pipenv.patched.pip._internal.models.link import Link
+from pipenv.patched.pip._internal.utils.compatibility_tags import get_supported
+from pipenv.patched.pip._internal.utils.temp_dir import global_tempdir_manager
+
+pytestmark = pytest.mark.wheel_cache
+
+SDIST_LINK = Link("https://example.com/simple/foo/foo-1.0.tar.gz")
+
+
+@pytest.fixture
+def supported_tags():
+    return get_supported()
+
+
+def _add_wheel(directory, filename):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, filename), "w"):
+        pass
+
+
+def test_wheel_cache_prefers_most_specific_supported_wheel(tmp_path):
+    supported_tags = [
+        Tag("cp311", "cp311", "manylinux_2_17_x86_64"),
+        Tag("cp311", "abi3", "manylinux_2_17_x86_64"),
+        Tag("py3", "none", "any"),
+    ]
+    cache = SimpleWheelCache(str(tmp_path))
+    wheel_dir = cache.get_path_for_link(SDIST_LINK)
+    for filename in (
+        "foo-1.0-py3-none-any.whl",
+        "foo-1.0-cp311-cp311-manylinux_2_17_x86_64.whl",
+        "foo-1.0-cp27-cp27m-win32.whl",
+        "bar-1.0-cp311-cp311-manylinux_2_17_x86_64.whl",
+        "not-a-wheel.txt",
+    ):
+        _add_wheel(wheel_dir, filename)
+
+    assert cache.get(SDIST_LINK, "foo", supported_tags).filename == (
+        "foo-1.0-cp311-cp311-manylinux_2_17_x86_64.whl"
+    )
+    assert cache.get(SDIST_LINK, "foo", supported_tags[2:]).filename == (
+        "foo-1.0-py3-none-any.whl"
+    )
+    unsupported_tags = [Tag("cp312", "cp312", "win_amd64")]
+    assert cache.get(SDIST_LINK, "foo", unsupported_tags) is SDIST_LINK
+
+    # Wheels that tie on their best tag are picked by file name.
+    _add_wheel(wheel_dir, "foo-1.0-1-cp311-cp311-manylinux_2_17_x86_64.whl")
+    assert cache.get(SDIST_LINK, "foo", supported_tags).filename == (
+        "foo-1.0-1-cp311-cp311-manylinux_2_17_x86_64.whl"
+    )
+
+
+def test_wheel_cache_finds_wheel_added_after_listing(tmp_path, supported_tags):
+    cache = SimpleWheelCache(str(tmp_path))
+    wheel_dir = cache.get_path_for_link(SDIST_LINK)
+    _add_wheel(wheel_dir, "foo-1.0-py3-none-any.whl")
+    # The directory was modified just now, as far as the cache can tell.
+    mtime_ns = time.time_ns()
+    os.utime(wheel_dir, ns=(mtime_ns, mtime_ns))
+    assert cache.get(SDIST_LINK, "foo", supported_tags).filename == (
+        "foo-1.0-py3-none-any.whl"
+    )
+
+    # Simulate a coarse filesystem clock: the directory mtime doesn't change.
+    _add_wheel(wheel_dir, "bar-1.0-py3-none-any.whl")
+    os.utime(wheel_dir, ns=(mtime_ns, mtime_ns))
+    assert cache.get(SDIST_LINK, "bar", supported_tags).filename == (
+        "bar-1.0-py3-none-any.whl"
+    )
+
+
+def test_wheel_cache_rescans_modified_directory(tmp_path, supported_tags):
+    cache = SimpleWheelCache(str(tmp_path))
+    wheel_dir = cache.get_path_for_link(SDIST_LINK)
+    _add_wheel(wheel_dir, "foo-1.0-py3-none-any.whl")
+    os.utime(wheel_dir, ns=(0, 0))
+    assert cache.get(SDIST_LINK, "bar", supported_tags) is SDIST_LINK
+
+    _add_wheel(wheel_dir, "bar-1.0-py3-none-any.whl")
+    assert cache.get(SDIST_LINK, "bar", supported_tags).filename == (
+        "bar-1.0-py3-none-any.whl"
+    )
+
+
+def test_wheel_cache_creates_ephem_cache_lazily(
+    tmp_path, monkeypatch, supported_tags
+):
+    temp_root = tmp_path / "tmp"
+    temp_root.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(temp_root))
+
+    with global_tempdir_manager():
+        cache = WheelCache(str(tmp_path / "cache"))
+        assert cache.get_cache_entry(SDIST_LINK, "foo", supported_tags) is None
+        assert list(temp_root.iterdir()) == []
+
+        _add_wheel(
+            cache.get_ephem_path_for_link(SDIST_LINK), "foo-1.0-py3-none-any.whl"
+        )
+        entry = cache.get_cache_entry(SDIST_LINK, "foo", supported_tags)
+        assert entry is not None
+        assert not entry.persistent
+        assert entry.link.filename == "foo-1.0-py3-none-any.whl"